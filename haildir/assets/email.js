@@ -11,7 +11,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     
     try {
         // Load email data using the index number (which is what we pass in the URL now)
-        const emailResponse = await fetch(`emails/${emailId}.json`);
+        const emailResponse = await fetch(`emails/${emailPath(emailId)}`);
         if (!emailResponse.ok) {
             throw new Error(`Email not found: ${emailId}`);
         }
@@ -95,4 +95,12 @@ function escapeHtml(text) {
         .replace(/>/g, "&gt;")
         .replace(/"/g, "&quot;")
         .replace(/'/g, "&#039;");
-}
\ No newline at end of file
+}
+
+// Emails are split into subdirectories of this many each (EMAILS_PER_DIR in hail.py)
+const EMAILS_PER_DIR = 1000;
+
+// Path of an email's file under emails/, given its index
+function emailPath(emailId) {
+    return `${Math.floor(Number(emailId) / EMAILS_PER_DIR)}/${emailId}.json`;
+}
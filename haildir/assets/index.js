@@ -23,6 +23,33 @@ function tokenize(text) {
     return text.toLowerCase().match(/[a-z0-9]+/g) || [];
 }
 
+// Unpack a posting list from search_index.json: the gaps between sorted email
+// indexes as varints (seven bits a byte, low bits first, high bit set on all
+// but the last byte), base64-encoded. See encode_postings in search.py. An
+// index from an older build holds plain arrays, which pass straight through.
+function decodePostings(encoded) {
+    if (typeof encoded !== 'string') return encoded;
+    const bytes = atob(encoded);
+    const ids = [];
+    let id = 0;
+    let gap = 0;
+    let scale = 1;
+    for (let i = 0; i < bytes.length; i++) {
+        const byte = bytes.charCodeAt(i);
+        // Multiplying rather than shifting keeps gaps past 2^31 intact
+        gap += (byte & 0x7f) * scale;
+        if (byte & 0x80) {
+            scale *= 128;
+        } else {
+            id += gap;
+            ids.push(id);
+            gap = 0;
+            scale = 1;
+        }
+    }
+    return ids;
+}
+
 // Look a query up in the inverted index.
 //
 // Returns the set of email indexes matching *every* word, along with the words
@@ -40,14 +67,13 @@ function searchIds(term, index) {
     let matched = null;
 
     for (const word of words) {
-        const posting = index[word];
-
-        if (posting === undefined) {
+        if (!Object.hasOwn(index, word)) {
             // No email holds this word, so nothing can hold all of them
             unknown.push(word);
             matched = new Set();
             continue;
         }
+        const posting = decodePostings(index[word]);
 
         if (posting.length === 0) {
             dropped.push(word);
@@ -81,11 +107,36 @@ function searchNotes(result) {
     return notes.join(' ');
 }
 
+// The most suggestions offered under an address filter at once
+const AUTOCOMPLETE_LIMIT = 20;
+
+// Return up to `limit` of the addresses starting with `prefix`. addresses.json
+// is sorted, so they sit together and a binary search finds the first one,
+// however long the list is.
+function addressesStartingWith(addresses, prefix, limit = AUTOCOMPLETE_LIMIT) {
+    let low = 0;
+    let high = addresses.length;
+    while (low < high) {
+        const middle = (low + high) >>> 1;
+        if (addresses[middle] < prefix) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    const matches = [];
+    for (let i = low; i < addresses.length && matches.length < limit; i++) {
+        if (!addresses[i].startsWith(prefix)) break;
+        matches.push(addresses[i]);
+    }
+    return matches;
+}
+
 // Node can load this file to exercise the search without a browser; nothing
 // below this point runs there (see the guard on the DOMContentLoaded hook).
 const inBrowser = typeof document !== 'undefined';
 if (!inBrowser && typeof module !== 'undefined' && module.exports) {
-    module.exports = { tokenize, searchIds, searchNotes };
+    module.exports = { tokenize, decodePostings, searchIds, searchNotes, addressesStartingWith };
 }
 
 function setStatus(message, busy) {
@@ -410,18 +461,23 @@ async function runSearch() {
     }
 }
 
-// Initialize autocomplete for address fields using datalist
+// Initialize autocomplete for address fields using datalist. Rather than
+// putting every address in the datalist up front, which for a large archive is
+// a great many elements, it is refilled with the matches for what has been
+// typed so far.
 function initAutocomplete() {
-    // Populate the datalist with email addresses
     const datalist = document.getElementById('email-datalist');
 
-    // Clear existing options
-    datalist.innerHTML = '';
-
-    // Add each address as an option
-    addresses.forEach(address => {
-        const option = document.createElement('option');
-        option.value = address;
-        datalist.appendChild(option);
-    });
+    const suggest = (event) => {
+        const prefix = event.target.value.toLowerCase();
+        datalist.innerHTML = '';
+        if (!prefix) return;
+        addressesStartingWith(addresses, prefix).forEach(address => {
+            const option = document.createElement('option');
+            option.value = address;
+            datalist.appendChild(option);
+        });
+    };
+    fromFilter.addEventListener('input', suggest);
+    toFilter.addEventListener('input', suggest);
 }
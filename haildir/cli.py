@@ -1,10 +1,21 @@
 import click
-import mailbox
+import collections
+import email.message
+import email.parser
+import functools
 import json
 import os
+import re
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import shutil
+import sys
 import logging
+import multiprocessing
+import tempfile
+import threading
+import time
+import traceback
 from . import hail
 from . import search
 from .search import InvertedIndex
@@ -32,8 +43,41 @@ SOURCES_FILE = "sources.json"
 # build made before this file existed used the default.
 BUILD_FILE = "build.json"
 
+# A binary copy of the search index that the next run loads faster than the
+# JSON, kept in WORK_DIR. Optional: without it, or once it is out of date,
+# search_index.json is read instead.
+INDEX_CACHE_FILE = search.INDEX_CACHE_FILE
+
+# Working files of a build that are not part of the site, such as that copy
+# and attachments waiting to be moved into place. Dot-named so it is easy to
+# leave out when the output directory is published.
+WORK_DIR = ".haildir"
+
+# Where attachments wait, within WORK_DIR, until their email is kept
+STAGING_DIR = "staging"
+
 # Directories generated from the Maildir
-GENERATED_DIRS = ("emails", "attachments")
+GENERATED_DIRS = ("emails", "attachments", WORK_DIR)
+
+# What a malformed message raises while being parsed (bad headers, dates,
+# encodings). Covers KeyError and UnicodeError through their base classes.
+MALFORMED_MESSAGE_ERRORS = (LookupError, ValueError, TypeError)
+
+# The delivery time a Maildir unique name starts with: seconds, then the
+# delivery identifier ("M1P2", "P1234", "R...", "Q...", "#...", or an old-style
+# process number), then the host. "1700000000.M1P2.host", "1700000000.1234.host"
+DELIVERY_TIME_RE = re.compile(r"(\d+)\.(?:[MPRQV#]|\d)[^.]*\.")
+
+# Delivery times outside these bounds (Maildir dates from 1995) are taken for
+# a file name that only looks like a unique name, and are not used
+EARLIEST_DELIVERY = 788918400
+LATEST_DELIVERY_AHEAD = 86400
+
+# An email file as named before they were split into subdirectories
+FLAT_EMAIL_RE = re.compile(r"\d+\.json")
+
+# Messages handed to a worker process at a time
+EMAILS_PER_TASK = 8
 
 
 class IncompleteBuild(click.ClickException):
@@ -46,8 +90,8 @@ class IncompleteBuild(click.ClickException):
 def write_json(path: Path, data) -> None:
     """Write a JSON file by replacing it, so an interrupted run leaves the old one intact."""
     tmp = path.with_name(path.name + ".tmp")
-    with tmp.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=None)
+    with tmp.open("wb") as f:
+        f.write(hail.json_dumps(data))
     os.replace(tmp, path)
 
 
@@ -77,6 +121,10 @@ def discard_temp_files(output_path: Path) -> None:
     """Drop the temporary files an interrupted run may have left behind."""
     for name in STATE_FILES + (SOURCES_FILE, BUILD_FILE):
         (output_path / f"{name}.tmp").unlink(missing_ok=True)
+    (output_path / WORK_DIR / f"{INDEX_CACHE_FILE}.tmp").unlink(missing_ok=True)
+
+    # Attachments staged by a run killed before it could keep them
+    shutil.rmtree(output_path / WORK_DIR / STAGING_DIR, ignore_errors=True)
 
 
 def find_closing_bracket(index_file: Path) -> tuple[int, bool]:
@@ -140,39 +188,53 @@ class IndexWriter:
         self.f = None
         self.first_item = True
 
-    def _start(self) -> None:
-        if self.incremental:
-            # Copy what previous runs recorded, minus the closing bracket
-            bracket, has_entries = find_closing_bracket(self.index_file)
-            with self.index_file.open("rb") as src, self.tmp_file.open("wb") as dst:
-                remaining = bracket
-                while remaining > 0:
-                    chunk = src.read(min(1024 * 1024, remaining))
-                    if not chunk:
-                        break
-                    dst.write(chunk)
-                    remaining -= len(chunk)
-            self.first_item = not has_entries
-        else:
-            with self.tmp_file.open("w", encoding="utf-8") as f:
-                f.write("[\n")
-            self.first_item = True
+    def __enter__(self) -> "IndexWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Anything not committed by now is thrown away, including on an error
+        # that escapes the loop, so no half-written copy is left open.
+        self.discard()
 
-        self.f = self.tmp_file.open("a", encoding="utf-8")
+    def _start(self) -> None:
+        # One handle for the whole run: entries are appended to it as they are
+        # built rather than reopening the file for each one.
+        dst = self.tmp_file.open("wb", buffering=hail.WRITE_BUFFER_SIZE)
+        try:
+            if self.incremental:
+                # Copy what previous runs recorded, minus the closing bracket
+                bracket, has_entries = find_closing_bracket(self.index_file)
+                with self.index_file.open("rb") as src:
+                    remaining = bracket
+                    while remaining > 0:
+                        chunk = src.read(min(1024 * 1024, remaining))
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        remaining -= len(chunk)
+                self.first_item = not has_entries
+            else:
+                dst.write(b"[\n")
+                self.first_item = True
+        except BaseException:
+            dst.close()
+            raise
+
+        self.f = dst
 
     def add(self, entry) -> None:
         if self.f is None:
             self._start()
         if not self.first_item:
-            self.f.write(",\n")
-        json.dump(entry, self.f, ensure_ascii=False, indent=None)
+            self.f.write(b",\n")
+        self.f.write(hail.json_dumps(entry))
         self.first_item = False
 
     def commit(self) -> None:
         """Close the array and put the finished file in place."""
         if self.f is None:
             self._start()
-        self.f.write("\n]")
+        self.f.write(b"\n]")
         self.f.close()
         self.f = None
         os.replace(self.tmp_file, self.index_file)
@@ -185,7 +247,114 @@ class IndexWriter:
         self.tmp_file.unlink(missing_ok=True)
 
 
-def load_state(output_path: Path) -> tuple[bool, set, int, dict, int]:
+class AddressBook:
+    """
+    The addresses offered for autocomplete, built up over the run.
+
+    An archive's addresses can run to millions, so only a fingerprint of each
+    one is held in memory to tell whether it is new. The new addresses are
+    spilled to a temporary file and merged with the previous addresses.json
+    when it is rewritten. A fingerprint is the address's hash(), which a str
+    computes and caches anyway; a collision would only leave one address out
+    of the autocomplete list.
+    """
+
+    def __init__(self, addresses_file: Path, existing: list, incremental: bool):
+        self.addresses_file = addresses_file
+        self.incremental = incremental
+        self.seen = {hash(address) for address in existing}
+        self.spill = tempfile.TemporaryFile()
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def update(self, addresses) -> None:
+        for address in addresses:
+            fingerprint = hash(address)
+            if fingerprint not in self.seen:
+                self.seen.add(fingerprint)
+                self.spill.write(hail.json_dumps(address))
+                self.spill.write(b"\n")
+
+    def save(self) -> None:
+        """Write addresses.json: the previous addresses plus the new ones, sorted."""
+        addresses = []
+        if self.incremental:
+            # Earlier builds recorded "" for a From with no address
+            addresses = [address for address in hail.json_load(self.addresses_file) if address]
+        self.spill.seek(0)
+        addresses.extend(hail.json_loads(line) for line in self.spill)
+        addresses.sort()
+        write_json(self.addresses_file, addresses)
+
+    def close(self) -> None:
+        self.spill.close()
+
+
+class EmailWriter:
+    """
+    Writes the email and attachment files on background threads, so the disk
+    is kept busy while the next messages are built.
+
+    An email is already in the indexes by the time its files are written. If
+    a write fails its file is left missing, and the next run puts it back the
+    way it puts back any missing email file.
+    """
+
+    def __init__(self, emails_dir: Path, attachments_dir: Path, staging_dir: Path,
+                 threads: int = 4, backlog: int = 32):
+        self.emails_dir = emails_dir
+        self.attachments_dir = attachments_dir
+        self.staging_dir = staging_dir
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="writer")
+        # Bounds the emails waiting to be written, and so the memory they hold
+        self.slots = threading.BoundedSemaphore(backlog)
+        self.lock = threading.Lock()
+        self.failed = 0
+        # Subdirectories of emails_dir known to exist, so each is made once
+        self.shards = set()
+
+    def __enter__(self) -> "EmailWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.executor.shutdown(wait=True)
+        if self.failed:
+            logger.error(
+                f"{self.failed} email files could not be written; "
+                "the next run writes them again."
+            )
+
+    def write(self, h: hail.Hail) -> None:
+        """Queue an email's files, waiting first if too many are queued already."""
+        self.slots.acquire()
+        try:
+            self.executor.submit(self._write, h)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _write(self, h: hail.Hail) -> None:
+        try:
+            # Only moved into place if a worker process staged them already
+            h.save_attachments(self.attachments_dir, self.staging_dir)
+            shard = (self.emails_dir / h.filename).parent
+            if shard not in self.shards:
+                shard.mkdir(exist_ok=True)
+                self.shards.add(shard)
+            h.save(self.emails_dir)
+        except Exception as e:
+            logger.error(f"Error writing {h.filename}: {e}", exc_info=True)
+            h.discard_attachments()
+            # A partial file would pass for a finished one next run
+            (self.emails_dir / h.filename).unlink(missing_ok=True)
+            with self.lock:
+                self.failed += 1
+        finally:
+            self.slots.release()
+
+
+def load_state(output_path: Path) -> tuple[bool, list, int, dict, int]:
     """
     Prepare the output directory for an incremental build.
 
@@ -198,7 +367,7 @@ def load_state(output_path: Path) -> tuple[bool, set, int, dict, int]:
     present = [name for name in STATE_FILES if (output_path / name).is_file()]
 
     if not present:
-        return False, set(), 0, {}, search.RESULT_LIMIT
+        return False, [], 0, {}, search.RESULT_LIMIT
 
     if len(present) != len(STATE_FILES):
         missing = [name for name in STATE_FILES if name not in present]
@@ -212,14 +381,14 @@ def load_state(output_path: Path) -> tuple[bool, set, int, dict, int]:
         find_closing_bracket(output_path / "index.json")
 
         initial_count = hail.Hail.load_id_idx(output_path)
-        with open(output_path / "addresses.json", "r", encoding="utf-8") as f:
-            addresses = set(json.load(f))
+        addresses = hail.json_load(output_path / "addresses.json")
+        if not isinstance(addresses, list):
+            raise ValueError(f"{output_path / 'addresses.json'} is not a JSON array")
 
         sources = {}
         sources_file = output_path / SOURCES_FILE
         if sources_file.is_file():
-            with open(sources_file, "r", encoding="utf-8") as f:
-                sources = json.load(f)
+            sources = hail.json_load(sources_file)
             if not isinstance(sources, dict):
                 raise ValueError(f"{sources_file} is not a JSON object")
 
@@ -227,8 +396,7 @@ def load_state(output_path: Path) -> tuple[bool, set, int, dict, int]:
         result_limit = search.RESULT_LIMIT
         build_file = output_path / BUILD_FILE
         if build_file.is_file():
-            with open(build_file, "r", encoding="utf-8") as f:
-                settings = json.load(f)
+            settings = hail.json_load(build_file)
             if not isinstance(settings, dict):
                 raise ValueError(f"{build_file} is not a JSON object")
             recorded = settings.get("max_postings", result_limit)
@@ -251,12 +419,223 @@ def load_state(output_path: Path) -> tuple[bool, set, int, dict, int]:
     return True, addresses, initial_count, sources, result_limit
 
 
+def scan_email_files(emails_dir: Path) -> set[str]:
+    """
+    Return the email files under emails_dir, as paths relative to it.
+
+    A build made before emails were split into subdirectories has them all
+    directly in emails_dir; those are moved to where they belong now.
+    """
+    existing_files = set()
+    # scandir's is_file() comes from the directory listing itself, where
+    # Path.is_file() would stat every file.
+    with os.scandir(emails_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                with os.scandir(entry.path) as shard:
+                    existing_files.update(
+                        f"{entry.name}/{file.name}" for file in shard if file.is_file()
+                    )
+            elif entry.is_file() and FLAT_EMAIL_RE.fullmatch(entry.name):
+                name = hail.email_filename(int(entry.name[:-len(".json")]))
+                (emails_dir / name).parent.mkdir(exist_ok=True)
+                os.replace(entry.path, emails_dir / name)
+                existing_files.add(name)
+    return existing_files
+
+
+def scan_maildir(maildir_path: Path) -> dict[str, str]:
+    """
+    Map each message in the Maildir to the path of its file.
+
+    The keys are the ones mailbox.Maildir uses (the file name up to the ':'
+    that starts its flags), so a sources.json written by an earlier run still
+    matches. cur/ and new/ are each listed once with os.scandir, without
+    mailbox's per-message bookkeeping, and in mailbox's order: a fresh build
+    numbers the emails the same way, and a key in both keeps the new/ file.
+    """
+    messages = {}
+    found = False
+    for subdir in ("cur", "new"):
+        try:
+            with os.scandir(maildir_path / subdir) as entries:
+                found = True
+                for entry in entries:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    messages[entry.name.split(":")[0]] = entry.path
+        except FileNotFoundError:
+            continue
+
+    if not found:
+        raise click.ClickException(f"{maildir_path} is not a Maildir: it has no cur/ or new/.")
+    return messages
+
+
+def read_message(path: str) -> email.message.Message:
+    """Parse a message file the way mailbox.Maildir would."""
+    with open(path, "rb") as f:
+        return email.message_from_binary_file(f)
+
+
+def read_headers(path: str, name: str | None = None) -> email.message.Message:
+    """
+    Parse only the header block of a message file, leaving the body unread.
+
+    Given a name, only that header (with any continuation lines) is kept, so
+    the parser is not handed the dozens of Received and other headers a real
+    message carries.
+    """
+    prefix = name.lower().encode("ascii") + b":" if name else None
+    lines = []
+    keep = True
+    with open(path, "rb") as f:
+        for line in f:
+            if line in (b"\n", b"\r\n"):
+                break
+            if prefix is not None and line[:1] not in (b" ", b"\t"):
+                # A new header starts: keep it (and its continuations) or not
+                keep = line[:len(prefix)].lower() == prefix
+            if keep:
+                lines.append(line)
+    return email.parser.BytesHeaderParser().parsebytes(b"".join(lines))
+
+
+def header_message_id(path: str) -> str | None:
+    """
+    Return the Message-ID of the message in a file, read from its headers
+    alone, or None if it has none or cannot be read.
+    """
+    try:
+        headers = read_headers(path, "Message-ID")
+    except OSError:
+        # Left for the full read to report
+        return None
+    # Only a real Message-ID: the substitute for a missing one is worked out
+    # (and warned about) when the message is read in full
+    if not headers.get("Message-ID"):
+        return None
+    return hail.Hail.message_id(headers)
+
+
+def delivery_time(path: str) -> int | None:
+    """
+    Return when a message was delivered, in seconds since the epoch, from the
+    time a Maildir file name starts with, or None if it does not.
+    """
+    match = DELIVERY_TIME_RE.match(os.path.basename(path))
+    if not match:
+        return None
+    delivered = int(match.group(1))
+    if not EARLIEST_DELIVERY <= delivered <= time.time() + LATEST_DELIVERY_AHEAD:
+        return None
+    return delivered
+
+
+def build_email(path: str, attachments_dir: Path | None = None,
+                staging_dir: Path | None = None) -> hail.Hail:
+    """
+    Parse one message and work out what the build needs from it, staging its
+    attachments too if given somewhere to put them.
+    """
+    h = hail.Hail(read_message(path), delivered=delivery_time(path))
+    h.prepare()
+    if staging_dir is not None:
+        h.stage_attachments(attachments_dir, staging_dir)
+    return h
+
+
+def build_emails(paths: list[str], attachments_dir: Path, staging_dir: Path) -> list:
+    """
+    Build a batch of emails in a worker process. A message that fails gives
+    its exception in place of its Hail, so it does not take the rest of the
+    batch down with it.
+
+    Attachments are written here, where they were decoded, rather than sent
+    to the main process: they are most of the bytes in a mailbox. They are
+    only staged, since the main process may yet turn the email away.
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(build_email(path, attachments_dir, staging_dir))
+        except Exception as e:
+            if not isinstance(e, MALFORMED_MESSAGE_ERRORS):
+                # The traceback does not survive the trip back to the parent
+                e.add_note(traceback.format_exc())
+            results.append(e)
+    return results
+
+
+def unwrap(result):
+    """Return a result from build_emails, raising it if it is an exception."""
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def read_emails(messages: dict[str, str], keys: list, jobs: int,
+                attachments_dir: Path, staging_dir: Path):
+    """
+    Yield (key, load) for each key in order, where load() returns the Hail
+    built from that message or raises whatever building it raised.
+
+    With more than one job the messages are read and parsed in worker
+    processes, EMAILS_PER_TASK at a time so the cost of handing work to a
+    process is spread over several messages. Only a few batches are handed
+    out ahead of the one being written, so the archive is never held in
+    memory all at once. No more processes are started than there are
+    batches, and a single batch is parsed in this process.
+    """
+    jobs = min(jobs, -(-len(keys) // EMAILS_PER_TASK))
+    if jobs <= 1:
+        for key in keys:
+            yield key, lambda key=key: build_email(messages[key])
+        return
+
+    def finish(batch, future):
+        try:
+            results = future.result()
+        except Exception as e:
+            # The whole batch was lost (a worker died, or a result could not
+            # be sent back): report it against each of its messages
+            results = [e] * len(batch)
+        for key, result in zip(batch, results):
+            yield key, functools.partial(unwrap, result)
+
+    # Forked workers start with the modules already imported instead of
+    # importing them afresh, which is the default from Python 3.14 on. Only
+    # on Linux, where forking is safe: the pool starts before the writer's
+    # threads do. Elsewhere the platform's default stands.
+    mp_context = multiprocessing.get_context("fork") if sys.platform == "linux" else None
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as executor:
+        pending = collections.deque()
+        for start in range(0, len(keys), EMAILS_PER_TASK):
+            batch = keys[start:start + EMAILS_PER_TASK]
+            try:
+                future = executor.submit(
+                    build_emails, [messages[key] for key in batch],
+                    attachments_dir, staging_dir,
+                )
+            except Exception as e:
+                # Reported against these messages when their turn comes
+                future = Future()
+                future.set_exception(e)
+            pending.append((batch, future))
+            if len(pending) >= jobs * 2:
+                yield from finish(*pending.popleft())
+        while pending:
+            yield from finish(*pending.popleft())
+
+
 def parse_maildir(
-    maildir_path: Path, output_path: Path, result_limit: int, limit_given: bool
+    maildir_path: Path, output_path: Path, result_limit: int, limit_given: bool,
+    jobs: int = 1, index_memory: int = search.INDEX_MEMORY,
 ) -> None:
     """Parse Maildir and extract email data, building indexes incrementally."""
     discard_temp_files(output_path)
     incremental, addresses, initial_count, sources, built_limit = load_state(output_path)
+    addresses = AddressBook(output_path / "addresses.json", addresses, incremental)
 
     if incremental:
         # The words a previous run dropped were stored as empty lists and their
@@ -272,20 +651,22 @@ def parse_maildir(
             )
         result_limit = built_limit
 
-    maildir = mailbox.Maildir(str(maildir_path))
-    keys = maildir.keys()
+    messages = scan_maildir(maildir_path)
+    keys = list(messages)
     logger.info(f"Found {len(keys)} messages in Maildir: {maildir_path}")
 
     # Create directories for email data and attachments
     emails_dir = output_path / "emails"
     attachments_dir = output_path / "attachments"
+    staging_dir = output_path / WORK_DIR / STAGING_DIR
     emails_dir.mkdir(exist_ok=True)
     attachments_dir.mkdir(exist_ok=True)
+    staging_dir.mkdir(parents=True, exist_ok=True)
 
     # Emails written out by a previous run; anything missing from here gets
     # rebuilt. Only consulted for indexes a previous run handed out: a file left
     # over from anything else is meaningless and gets overwritten.
-    existing_files = {f.name for f in emails_dir.iterdir() if f.is_file()}
+    existing_files = scan_email_files(emails_dir)
 
     # Indexes handed out during this run, to skip duplicate Message-IDs
     built_this_run = set()
@@ -294,105 +675,156 @@ def parse_maildir(
     # rather than edited, so files that have left the Maildir drop out.
     new_sources = {}
 
-    index_writer = IndexWriter(output_path / "index.json", incremental)
-    inverted_index = InvertedIndex(
-        output_path, load_existing=incremental, result_limit=result_limit
-    )
-
-    added = 0
-    rebuilt = 0
-    skipped = 0
-
-    # Process each message with progress bar
-    with click.progressbar(
-        keys,
-        length=len(keys),
-        label='Processing emails',
-        item_show_func=lambda x: f"Email {x}" if x else ""
-    ) as bar:
-        for key in bar:
-            h = None
-            try:
-                # A file a previous run already built is skipped without being
-                # opened, which is what makes a re-run cheap.
-                known_idx = sources.get(key)
-                if known_idx is not None and f"{known_idx}.json" in existing_files:
-                    new_sources[key] = known_idx
-                    skipped += 1
-                    continue
+    with IndexWriter(output_path / "index.json", incremental) as index_writer:
+        inverted_index = InvertedIndex(
+            output_path, load_existing=incremental, result_limit=result_limit,
+            memory_limit=index_memory << 20,
+            cache_file=output_path / WORK_DIR / INDEX_CACHE_FILE,
+        )
 
-                # Create Hail instance for the message; a message seen by an
-                # earlier run keeps the index it was given then.
-                h = hail.Hail(maildir[key])
+        added = 0
+        rebuilt = 0
+        skipped = 0
+
+        # A file a previous run already built is skipped without being opened,
+        # which is what makes a re-run cheap. A file it does not know about may
+        # still be another copy of a message already built, or of one about
+        # to be (the same email under a second label, say): its headers are
+        # enough to tell, so the body is never parsed.
+        # With nothing built before there is no message to match, and the
+        # copies within this run are caught as they are built, so a fresh
+        # build goes straight to the workers rather than reading every
+        # file's headers first.
+        to_read = keys
+        duplicates = []
+        if initial_count:
+            to_read = []
+            read_ids = set()
+            with click.progressbar(keys, label='Checking for new messages') as pending:
+                for key in pending:
+                    known_idx = sources.get(key)
+                    if known_idx is None:
+                        message_id = header_message_id(messages[key])
+                        if message_id is not None:
+                            if message_id in read_ids:
+                                duplicates.append((key, message_id))
+                                continue
+                            read_ids.add(message_id)
+                            # Only a previous run's ids are known at this point
+                            known_idx = hail.Hail.d.get(message_id)
+                    if known_idx is not None and hail.email_filename(known_idx) in existing_files:
+                        new_sources[key] = known_idx
+                        skipped += 1
+                    else:
+                        to_read.append(key)
+            del read_ids
+
+        # Process each message with progress bar
+        with EmailWriter(emails_dir, attachments_dir, staging_dir) as writer, click.progressbar(
+            length=len(keys),
+            label='Processing emails',
+            item_show_func=lambda x: f"Email {x}" if x else ""
+        ) as bar:
+            bar.update(skipped + len(duplicates))
+            for key, load in read_emails(messages, to_read, jobs, attachments_dir, staging_dir):
+                bar.update(1, key)
+                h = None
+                try:
+                    # A message seen by an earlier run keeps the index it was
+                    # given then.
+                    h = load()
+                    h.claim()
+
+                    if h.idx < initial_count:
+                        # Already in the indexes from an earlier run
+                        if h.filename in existing_files:
+                            h.discard_attachments()
+                            new_sources[key] = h.idx
+                            skipped += 1
+                            continue
+                        # Its file is gone: put the file back, leaving the indexes
+                        # (which already describe it) alone.
+                        writer.write(h)
+                        existing_files.add(h.filename)
+                        new_sources[key] = h.idx
+                        rebuilt += 1
+                        continue
 
-                if h.idx < initial_count:
-                    # Already in the indexes from an earlier run
-                    if h.filename in existing_files:
+                    if h.idx in built_this_run:
+                        # Another copy of a message already built this run
+                        h.discard_attachments()
                         new_sources[key] = h.idx
                         skipped += 1
                         continue
-                    # Its file is gone: put the file back, leaving the indexes
-                    # (which already describe it) alone.
-                    h.save_attachments(attachments_dir)
-                    h.save(emails_dir)
-                    existing_files.add(h.filename)
-                    new_sources[key] = h.idx
-                    rebuilt += 1
-                    continue
-
-                if h.idx in built_this_run:
-                    # Another copy of a message already built this run
-                    new_sources[key] = h.idx
-                    skipped += 1
-                    continue
 
-                # Update the global addresses set with extracted addresses
-                addresses.update(h.addresses)
+                    # Record any addresses not seen before
+                    addresses.update(h.addresses)
 
-                # Save attachments if any
-                h.save_attachments(attachments_dir)
+                    # Add to inverted search index
+                    inverted_index.add_email(h)
 
-                h.save(emails_dir)
+                    # Add to main index
+                    index_writer.add(h.index_data)
 
-                # Add to inverted search index
-                inverted_index.add_email(h)
+                    # Save the email and any attachments
+                    writer.write(h)
 
-                # Add to main index
-                index_writer.add(h.index_data)
+                    built_this_run.add(h.idx)
+                    new_sources[key] = h.idx
+                    added += 1
+
+                except Exception as e:
+                    # Malformed mail is expected in any large Maildir and its
+                    # traceback says nothing new; keep tracebacks for anything
+                    # that looks like a bug.
+                    logger.error(
+                        f"Error processing message {key}: {e}",
+                        exc_info=not isinstance(e, MALFORMED_MESSAGE_ERRORS),
+                    )
+                    if h is not None:
+                        # Nothing failing here was handed to the writer yet
+                        h.discard_attachments()
+                    if (
+                        h is not None
+                        and h.idx >= initial_count
+                        and h.idx not in built_this_run
+                    ):
+                        # It never made it into the indexes, so drop the id and any
+                        # half-written file and let the next run try again instead
+                        # of assuming it was done. Its Maildir file is deliberately
+                        # left out of new_sources so it is read again.
+                        hail.Hail.forget(h.original_id)
+                        (emails_dir / h.filename).unlink(missing_ok=True)
+                    continue
 
-                built_this_run.add(h.idx)
-                new_sources[key] = h.idx
-                added += 1
+        for key, message_id in duplicates:
+            # A copy of a message read above. If that failed its id was
+            # forgotten, and this copy is left for the next run to read.
+            idx = hail.Hail.d.get(message_id)
+            if idx is not None:
+                new_sources[key] = idx
+                skipped += 1
 
-            except Exception as e:
-                logger.error(f"Error processing message {key}: {e}", exc_info=True)
-                if h is not None and h.idx >= initial_count and h.idx not in built_this_run:
-                    # It never made it into the indexes, so drop the id and any
-                    # half-written file and let the next run try again instead
-                    # of assuming it was done. Its Maildir file is deliberately
-                    # left out of new_sources so it is read again.
-                    hail.Hail.forget(h.original_id)
-                    (emails_dir / h.filename).unlink(missing_ok=True)
-                continue
-
-    logger.info(
-        f"Added {added} new emails, rebuilt {rebuilt} missing files, "
-        f"skipped {skipped} already built."
-    )
-
-    if added or not incremental:
-        index_writer.commit()
-        write_json(output_path / "addresses.json", sorted(addresses))
-        inverted_index.save()
-        hail.Hail.save_id_idx(output_path)
         logger.info(
-            f"Completed processing. Generated {len(hail.Hail.d)} email entries "
-            f"and {len(addresses)} unique addresses."
+            f"Added {added} new emails, rebuilt {rebuilt} missing files, "
+            f"skipped {skipped} already built."
         )
-    else:
-        # Nothing reached the indexes, so leave them exactly as they were
-        index_writer.discard()
-        logger.info("Indexes unchanged.")
+
+        if added or not incremental:
+            index_writer.commit()
+            addresses.save()
+            inverted_index.save()
+            hail.Hail.save_id_idx(output_path)
+            logger.info(
+                f"Completed processing. Generated {len(hail.Hail.d)} email entries "
+                f"and {len(addresses)} unique addresses."
+            )
+        else:
+            # Nothing reached the indexes, so leave them exactly as they were
+            index_writer.discard()
+            logger.info("Indexes unchanged.")
+
+    addresses.close()
 
     if new_sources != sources:
         write_json(output_path / SOURCES_FILE, new_sources)
@@ -440,9 +872,30 @@ def copy_assets(output_path: Path) -> None:
         "run dropped cannot be recovered from the existing index."
     ),
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Number of processes parsing messages in parallel. Defaults to the "
+        "number of CPUs; 1 parses everything in this process."
+    ),
+)
+@click.option(
+    "--index-memory",
+    type=click.IntRange(min=1),
+    default=search.INDEX_MEMORY,
+    show_default=True,
+    help=(
+        "Memory, in MiB, the search index may take while it is built. Beyond "
+        "that it is written out to temporary files and merged at the end."
+    ),
+)
 @click.pass_context
 def main(
-    ctx: click.Context, maildir_path: str, output_path: str, rebuild: bool, result_limit: int
+    ctx: click.Context, maildir_path: str, output_path: str, rebuild: bool,
+    result_limit: int, jobs: int | None, index_memory: int,
 ) -> None:
     """
     Convert a Maildir archive to a static, searchable HTML site.
@@ -470,7 +923,10 @@ def main(
     limit_given = (
         ctx.get_parameter_source("result_limit") != click.core.ParameterSource.DEFAULT
     )
-    parse_maildir(maildir_path_obj, output_path_obj, result_limit, limit_given)
+    parse_maildir(
+        maildir_path_obj, output_path_obj, result_limit, limit_given,
+        jobs or os.cpu_count() or 1, index_memory,
+    )
     logger.info("Email parsing completed.")
 
     # Copy assets
@@ -478,13 +934,9 @@ def main(
     copy_assets(output_path_obj)
     logger.info("Assets copied successfully.")
 
-    # Count processed emails by counting files in emails directory
-    emails_dir = output_path_obj / "emails"
-    email_count = (
-        len([f for f in emails_dir.iterdir() if f.is_file()])
-        if emails_dir.exists()
-        else 0
-    )
+    # Every email in the output has an entry in the id mapping, so there is no
+    # need to list (and stat) the whole emails directory to count them
+    email_count = len(hail.Hail.d)
 
     logger.info("Conversion completed successfully!")
     logger.info(f"Total emails processed: {email_count}")
@@ -3,11 +3,58 @@ import os
 from pathlib import Path
 import re
 import email as std_email
-from email.utils import parseaddr
+from datetime import datetime, timezone
+from email.utils import getaddresses, parseaddr, parsedate_to_datetime
 import hashlib
+import html
 import logging
+import itertools
+from functools import cached_property, lru_cache
 from dateutil import parser as dateutil_parser
 
+try:
+    import orjson
+except ImportError:
+    # Optional (pip install haildir[fast]): the standard library writes the
+    # same data, just more slowly
+    orjson = None
+
+
+# Built once: json.dumps with any non-default option builds a new encoder on
+# every call. The separators match orjson's output.
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+# Buffer size for files written as many small pieces (index.json, the search
+# index), so each piece is not a write() call of its own
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def json_dumps(data) -> bytes:
+    """
+    Serialize data to compact UTF-8 JSON, with orjson when it is installed.
+
+    Bytes, as orjson produces them, so files are written in binary mode
+    without a round trip through str.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return JSON_ENCODER.encode(data).encode("utf-8")
+
+
+def json_loads(data):
+    """Parse JSON text or UTF-8 bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_load(path):
+    """Read and parse a JSON file, with orjson when it is installed."""
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+
 # Read user email addresses from config.json if it exists
 def get_user_emails():
     """Read user email addresses from config.json in the root directory."""
@@ -16,15 +63,59 @@ def get_user_emails():
         try:
             with open(config_path, "r", encoding="utf-8") as f:
                 config = json.load(f)
-                return set(config.get("user_emails", []))  # Return a set of user emails
+                # Lowercased to match from_addr, which is always lowercase
+                return frozenset(e.lower() for e in config.get("user_emails", []))
         except (json.JSONDecodeError, FileNotFoundError):
             logging.warning(f"Could not read config.json: {config_path}")
-            return set()
-    return set()
+            return frozenset()
+    return frozenset()
 
 # Read user emails once at module load time
 USER_EMAILS = get_user_emails()
 
+# Compiled once rather than looked up in the re cache for every Date header.
+# Content in parentheses at the end (like "(GMT+00:00)")
+PARENTHESES_END_RE = re.compile(r"\([^)]*\)$")
+# Alphabetic text at the end (like "Pacific Standard Time")
+TEXT_END_RE = re.compile(r"[a-zA-Z][a-zA-Z\s]+$")
+
+# How an email's date is shown
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+# The fields of an email file that can be large, in the order to_dict ends with
+LARGE_FIELDS = ("body_text", "body_html", "attachments")
+
+# Email files are spread over numbered subdirectories of this many each, so no
+# one directory grows huge; email.js builds the same path
+EMAILS_PER_DIR = 1000
+
+# Numbers the attachment files a process stages, so no two share a name
+STAGED_COUNT = itertools.count()
+
+
+def email_filename(idx: int) -> str:
+    """Return the path of the email with the given index, relative to emails/."""
+    return f"{idx // EMAILS_PER_DIR}/{idx}.json"
+
+
+# For indexing HTML-only emails: the parts of a document that are never shown
+# (style sheets, scripts, comments), and any tag with its attributes. An
+# opener with no closer hides the rest of the body, as it does in a browser;
+# matching only up to a closer would search to the end again from every
+# later opener, which on a spam body full of them takes seconds.
+HIDDEN_HTML_RE = re.compile(
+    r"<(style|script)\b.*?(?:</\1\s*>|\Z)|<!--.*?(?:-->|\Z)", re.IGNORECASE | re.DOTALL
+)
+# A tag cannot hold a '<', so a stray one ("a < b") is passed over once
+# rather than searched from to the end of the body for a '>'
+TAG_RE = re.compile(r"<[^<>]*>")
+
+# The bytes deleted from a saved attachment's extension: everything but ASCII
+# letters, digits, '-' and '_', removed in one pass in C
+EXTENSION_UNSAFE = bytes(
+    b for b in range(256) if not (chr(b).isascii() and (chr(b).isalnum() or chr(b) in "-_"))
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -33,76 +124,189 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=65536)
+def normalize_address(entry):
+    """
+    Return the lowercased address in one From/To/Cc entry, or "" if it has none.
+
+    Cached because the same senders and lists turn up in message after message.
+    """
+    return parseaddr(entry)[1].lower()
+
+
+@lru_cache(maxsize=65536)
+def parse_address_list(header):
+    """
+    Return the lowercased addresses in a To or Cc header, as a tuple.
+
+    getaddresses() understands quoted display names, so "Smith, John" <j@x>
+    is one address rather than two. Cached for the same reason as
+    normalize_address: list traffic repeats the same To and Cc headers.
+    """
+    return tuple(addr.lower() for _, addr in getaddresses([header]) if addr)
+
+
+def html_text(body_html):
+    """Return roughly the text a browser would show for an HTML body."""
+    text = HIDDEN_HTML_RE.sub(" ", body_html)
+    text = TAG_RE.sub(" ", text)
+    # After the tags are gone, so an escaped '<' cannot start a new one
+    return html.unescape(text)
+
+
+def clean_datetime_string(date_str):
+    """Clean datetime string by removing unwanted suffixes before parsing."""
+    # Remove parentheses content at the end
+    cleaned = PARENTHESES_END_RE.sub("", date_str)
+    # Remove trailing alphabetic text
+    cleaned = TEXT_END_RE.sub("", cleaned)
+    return cleaned.strip()
+
+
+@lru_cache(maxsize=4096)
+def format_date(date_str):
+    """
+    Return a Date header's value in YYYY-MM-DD HH:mm format, or "" if it
+    cannot be parsed.
+
+    Cached: copies of a message, and the posts of a digest, share a Date.
+    """
+    date_obj = None
+
+    try:
+        # Nearly every Date header is RFC 5322, which the standard
+        # library parses far faster than dateutil does
+        date_obj = parsedate_to_datetime(date_str)
+    except (ValueError, TypeError):
+        pass
+
+    if date_obj is None:
+        try:
+            # Most of the rest come from software that writes ISO 8601
+            date_obj = datetime.fromisoformat(date_str.strip())
+        except ValueError:
+            pass
+
+    if date_obj is None:
+        try:
+            # Clean the datetime string by removing unwanted suffixes before parsing
+            cleaned_date_str = clean_datetime_string(date_str)
+            # Use dateutil to parse the date string, which handles many formats automatically
+            date_obj = dateutil_parser.parse(cleaned_date_str)
+        except (ValueError, TypeError, OverflowError) as e:
+            logger.warning(f"Unable to parse date: {date_str}. Error: {e}")
+
+    return date_obj.strftime(DATE_FORMAT) if date_obj else ""
+
+
 class Hail:
     """
     A class to represent an email message from a Maildir.
+
+    The values worked out from the message (bodies, date, addresses) are
+    cached on first use: building an email reads most of them several times
+    over, and each read would otherwise walk and decode the message again.
     """
     # Class-level properties to track message IDs
-    ls = []  # List of id strings
-    d = {}  # Dict mapping id strings to their index in the list
+    d = {}  # Dict mapping id strings to their index
+    next_idx = 0  # The index the next new id is given
 
-    def __init__(self, msg):
+    def __init__(self, msg, delivered=None):
         """
         Initialize the Hail instance with a message object from Maildir.
 
+        The message has no index until claim() is called, which only the
+        process writing the indexes may do: a worker process builds the
+        email, and the indexes are handed out in the order the results are
+        written.
+
         Args:
             msg: The message object from iterating through the maildir
-            key: The key from the maildir iteration
+            delivered: When the message was delivered, in seconds since the
+                epoch, if known (see cli.delivery_time)
         """
         self.msg = msg
+        self.delivered = delivered
 
         # Extract and set the original Message-ID
         self.original_id = type(self).message_id(msg)
-
-        # Add the ID to class-level tracking
+        self.idx = None
+        # Attachment files written to the staging directory and not yet moved
+        # into place, by their saved_filename
+        self.staged = {}
+        self.attachments_staged = False
+
+    def claim(self):
+        """Give the message its index, reusing the one an earlier copy was given."""
         self_cls = type(self)
-        if self.original_id not in self_cls.d:
-            idx = len(type(self).ls)
-            self_cls.ls.append(self.original_id)
+        # One lookup: most messages in a Gmail archive are copies of one
+        # already seen, so this is the common case rather than the exception
+        idx = self_cls.d.get(self.original_id)
+        if idx is None:
+            idx = self_cls.next_idx
+            self_cls.next_idx = idx + 1
             self_cls.d[self.original_id] = idx
-            self.idx = idx
-        else:
-            # If already exists, use existing index
-            self.idx = self_cls.d[self.original_id]
+        self.idx = idx
+        return idx
+
+    def prepare(self):
+        """
+        Work out everything the build reads from the message, then let the
+        message go.
+
+        The parsed message is the bulk of the object, and a built email can
+        wait a while in the writer's backlog or cross to another process, so
+        only the values cached from it are kept.
+        """
+        for name in ("subject", "date", "from_addr", "to_addr", "cc_addr",
+                     "from_me", "addresses", "preview", "attachments",
+                     "search_words"):
+            getattr(self, name)
+        self.msg = None
 
     @staticmethod
     def message_id(msg):
         """Return the Message-ID of a message, or a stable substitute if it has none."""
         original_id = msg.get("Message-ID", "")
         if not original_id:
-            logger.warning(f"Failed to get Message-ID: {msg}")
-            # Generate a unique ID if Message-ID is missing
-            original_id = hashlib.md5(
-                f"{msg.get('From', '')}{msg.get('Date', '')}".encode()
-            ).hexdigest()
+            # Not the message itself: formatting it would flatten every part,
+            # attachments included, into the log line
+            logger.warning(
+                f"Failed to get Message-ID: From {msg.get('From', '')!r}, "
+                f"Date {msg.get('Date', '')!r}"
+            )
+            # Generate a unique ID if Message-ID is missing. This one stays MD5:
+            # it is a key in id_mapping.json, so changing the hash would give
+            # every such message a new index on the next incremental build.
+            digest = hashlib.md5()
+            digest.update(str(msg.get("From", "")).encode())
+            digest.update(str(msg.get("Date", "")).encode())
+            original_id = digest.hexdigest()
         return original_id
 
-    @property
+    @cached_property
     def from_addr(self):
         """Return the from address."""
-        return parseaddr(self.msg.get("From", ""))[1].lower()
+        return normalize_address(self.msg.get("From", ""))
 
-    @property
+    @cached_property
     def to_addr(self):
         """Return the to address."""
-        to_header = self.msg.get("To", "")
-        if to_header:
-            # Split multiple addresses by comma and parse each one
-            addresses = [addr.strip() for addr in to_header.split(',')]
-            return [parseaddr(addr)[1].lower() for addr in addresses if parseaddr(addr)[1]]
-        return []
+        return self.header_addresses("To")
 
-    @property
+    @cached_property
     def cc_addr(self):
         """Return the cc address."""
-        cc_header = self.msg.get("Cc", "")
-        if cc_header:
-            # Split multiple addresses by comma and parse each one
-            addresses = [addr.strip() for addr in cc_header.split(',')]
-            return [parseaddr(addr)[1].lower() for addr in addresses if parseaddr(addr)[1]]
+        return self.header_addresses("Cc")
+
+    def header_addresses(self, name):
+        """Return the addresses listed in a To or Cc header."""
+        header = self.msg.get(name, "")
+        if header:
+            return list(parse_address_list(header))
         return []
 
-    @property
+    @cached_property
     def subject(self):
         """Return the subject of the email."""
         subject = self.msg.get("Subject", "")
@@ -110,112 +314,136 @@ class Hail:
             subject = str(subject)
         return subject
 
-    @property
+    @cached_property
     def date(self):
-        """Return the parsed date in YYYY-MM-DD HH:mm format."""
-        def clean_datetime_string(date_str):
-            """Clean datetime string by removing unwanted suffixes before parsing."""
-            # Pattern to capture content in parentheses at the end (like "(GMT+00:00)")
-            parentheses_pattern = r"\([^)]*\)$"
-            # Pattern to capture alphabetic text at the end (like "Pacific Standard Time")
-            text_end_pattern = r"[a-zA-Z][a-zA-Z\s]+$"
-
-            # Remove parentheses content at the end
-            cleaned = re.sub(parentheses_pattern, "", date_str)
-            # Remove trailing alphabetic text
-            cleaned = re.sub(text_end_pattern, "", cleaned)
-            return cleaned.strip()
+        """
+        Return the parsed date in YYYY-MM-DD HH:mm format.
 
+        Without a Date header that can be parsed, falls back to the time the
+        message was delivered, as recorded in its Maildir file name (in UTC).
+        """
         date_str = self.msg.get("Date", "")
-        date_obj = None
-
-        if date_str:
+        date = format_date(str(date_str)) if date_str else ""
+        if not date and self.delivered is not None:
             try:
-                # Clean the datetime string by removing unwanted suffixes before parsing
-                cleaned_date_str = clean_datetime_string(date_str)
-                # Use dateutil to parse the date string, which handles many formats automatically
-                date_obj = dateutil_parser.parse(cleaned_date_str)
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Unable to parse date: {date_str}. Error: {e}")
-
-        return date_obj.strftime("%Y-%m-%d %H:%M") if date_obj else ""
-
-    @property
+                delivered = datetime.fromtimestamp(self.delivered, timezone.utc)
+            except (ValueError, OverflowError, OSError):
+                # Out of the platform's range: no date beats a broken email
+                return ""
+            date = delivered.strftime(DATE_FORMAT)
+        return date
+
+    @cached_property
     def addresses(self):
         """Return the set of addresses for autocomplete."""
-        addresses = set()
-        addresses.add(self.from_addr)
-        for addrs in [self.to_addr, self.cc_addr]:
-            for addr in addrs:
-                addresses.add(addr)
+        # Already lowercased; To and Cc never hold an empty address, but a
+        # From header without one gives ""
+        addresses = {self.from_addr, *self.to_addr, *self.cc_addr}
+        addresses.discard("")
         return addresses
 
-    @property
+    @cached_property
     def from_me(self):
         """Return whether the email is from one of the user's addresses."""
         return self.from_addr in USER_EMAILS
 
+    @cached_property
+    def _parts(self):
+        """
+        Walk the message once, sorting its parts into the text body, the HTML
+        body and the attachments.
+
+        Returns (body_text, body_html, attachments), where each attachment is
+        a pair of its metadata and its decoded bytes. A part can land in more
+        than one: a text/plain file sent as an attachment is both shown in the
+        body and saved, from a single decode of its payload.
+        """
+        text_chunks = []
+        html_chunks = []
+        attachments = []
+
+        # walk() yields the message itself when it is not multipart
+        for part in self.msg.walk():
+            content_type = part.get_content_type()
+            if content_type.startswith("multipart/"):
+                # A container: its children follow in the walk, and it has
+                # no payload of its own to decode
+                continue
+
+            if content_type == "text/plain":
+                chunks = text_chunks
+            elif content_type == "text/html":
+                chunks = html_chunks
+            else:
+                chunks = None
+
+            filename = None
+            if part.get_content_disposition() == "attachment":
+                filename = part.get_filename()
+
+            if chunks is None and not filename:
+                continue
+
+            payload = part.get_payload(decode=True)
+
+            if chunks is not None:
+                if isinstance(payload, bytes):
+                    charset = part.get_content_charset() or "utf-8"
+                    try:
+                        chunks.append(payload.decode(charset, errors="replace"))
+                    except LookupError:
+                        # A charset Python has no codec for; UTF-8 with
+                        # replacement still recovers most of the text.
+                        logger.warning(f"Unknown charset {charset} in {content_type} part")
+                        chunks.append(payload.decode("utf-8", errors="replace"))
+                elif payload is not None:
+                    chunks.append(str(payload))
+
+            if filename:
+                attachments.append(({
+                    "filename": filename,
+                    "saved_filename": self.attachment_filename(filename, payload),
+                    "content_type": content_type,
+                }, payload))
+
+        return "".join(text_chunks), "".join(html_chunks), attachments
+
+    @staticmethod
+    def attachment_filename(filename, payload):
+        """
+        Return the name an attachment is saved under: a digest of its
+        content, so the same file sent to many emails (a mailing list, a
+        signature logo) is stored once.
+        """
+        # The extension comes from the sender, so it is cut down to ASCII
+        # characters that are safe in a file name: a '/' in it would point
+        # outside the attachments directory.
+        if '.' in filename:
+            ext = filename.split('.')[-1].encode("ascii", "ignore").translate(
+                None, EXTENSION_UNSAFE
+            ).decode("ascii")
+        else:
+            ext = ''
+        return hashlib.blake2b(payload or b"", digest_size=16).hexdigest() + (
+            f".{ext}" if ext else ""
+        )
+
     @property
     def body_text(self):
         """Return the plain text body of the email."""
-        body_text = ""
-        if self.msg.is_multipart():
-            for part in self.msg.walk():
-                if part.get_content_type() == "text/plain":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if isinstance(payload, bytes):
-                            body_text += payload.decode(
-                                part.get_content_charset() or "utf-8",
-                                errors="replace",
-                            )
-                        else:
-                            body_text += str(payload)
-                    except Exception as e:
-                        logger.warning(f"Error decoding text/plain payload: {e}")
-        else:
-            if self.msg.get_content_type() == "text/plain":
-                payload = self.msg.get_payload(decode=True)
-                if isinstance(payload, bytes):
-                    body_text = payload.decode(
-                        self.msg.get_content_charset() or "utf-8",
-                        errors="replace"
-                    )
-                else:
-                    body_text = str(payload)
-        return body_text
+        return self._parts[0]
 
     @property
     def body_html(self):
         """Return the HTML body of the email."""
-        body_html = ""
-        if self.msg.is_multipart():
-            for part in self.msg.walk():
-                if part.get_content_type() == "text/html":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if isinstance(payload, bytes):
-                            body_html += payload.decode(
-                                part.get_content_charset() or "utf-8",
-                                errors="replace",
-                            )
-                        else:
-                            body_html += str(payload)
-                    except Exception as e:
-                        logger.warning(f"Error decoding text/html payload: {e}")
-        else:
-            if self.msg.get_content_type() == "text/html":
-                payload = self.msg.get_payload(decode=True)
-                if isinstance(payload, bytes):
-                    body_html = payload.decode(
-                        self.msg.get_content_charset() or "utf-8",
-                        errors="replace"
-                    )
-                else:
-                    body_html = str(payload)
-        return body_html
+        return self._parts[1]
 
-    @property
+    @cached_property
+    def attachments(self):
+        """Return the metadata of the email's attachments."""
+        return [info for info, _ in self._parts[2]]
+
+    @cached_property
     def preview(self):
         """Return preview text (first 100 characters of body)."""
         body_content = self.body_text or self.body_html
@@ -234,12 +462,13 @@ class Hail:
             "from_me": self.from_me,
             "body_text": self.body_text,
             "body_html": self.body_html,
-            "attachments": self._attachments,
+            "attachments": self.attachments,
         }
 
     @property
     def index_data(self):
         """Return the index data as a dictionary."""
+        attachments = self.attachments
         return {
             "id": self.original_id,
             "date": self.date,
@@ -249,77 +478,139 @@ class Hail:
             "cc": self.cc_addr,
             "from_me": self.from_me,
             "preview": self.preview,
-            "has_attachments": len(self._attachments) > 0,
-            "attachment_count": len(self._attachments),
-            "attachments": [a["filename"] for a in self._attachments]  # Just the filenames for the index
+            "has_attachments": len(attachments) > 0,
+            "attachment_count": len(attachments),
+            "attachments": [a["filename"] for a in attachments]  # Just the filenames for the index
         }
 
-    def save_attachments(self, output_dir: Path):
+    def stage_attachments(self, output_dir: Path, staging_dir: Path):
         """
-        Save any attachments in the given output directory.
+        Write the attachments not already in output_dir to staging_dir.
+
+        A worker process stages them where they were decoded, so the bytes
+        never cross to the main process. The main process then moves them
+        into place with save_attachments if it keeps the email, or deletes
+        them with discard_attachments if it does not. The decoded payloads
+        are let go once written, and a second call writes nothing.
 
         Args:
-            output_dir: The directory where attachments should be saved
+            output_dir: The directory the attachments are saved in
+            staging_dir: The directory they wait in until then
         """
+        body_text, body_html, attachments = self._parts
+        if self.attachments_staged:
+            return
 
-        attachments = []
+        try:
+            for info, payload in attachments:
+                name = info["saved_filename"]
+                if name in self.staged or (output_dir / name).exists():
+                    # The name is a digest of the content, so this is the same file
+                    logger.debug(f"Attachment already saved: {name}")
+                    continue
+
+                if not payload:
+                    logger.debug(f"Attachment Missing: {info['filename']}")
+
+                # A file of its own, since other emails may be staging the
+                # same attachment at once
+                staged = str(staging_dir / f"{name}.{os.getpid()}-{next(STAGED_COUNT)}")
+                self.staged[name] = staged
+                with open(staged, "wb") as f:
+                    if payload:
+                        f.write(payload)
+        except BaseException:
+            self.discard_attachments()
+            raise
+
+        self._parts = (body_text, body_html, [(info, None) for info, _ in attachments])
+        self.attachments_staged = True
+
+    def save_attachments(self, output_dir: Path, staging_dir: Path):
+        """
+        Save any attachments in the given output directory, staging first
+        any that are not staged yet.
 
-        for part in self.msg.walk():
-            if part.get_content_disposition() == "attachment":
-                filename = part.get_filename()
-                if filename:
-                    # Generate a unique filename for the attachment
-                    if '.' in filename:
-                        ext = filename.split('.')[-1]
-                    else:
-                        ext = ''
-                    attachment_filename = hashlib.md5(
-                        f"{self.original_id}{filename}".encode()
-                    ).hexdigest() + ext
-
-                    logger.debug(f"Processing attachment: {filename} for email {self.original_id}")
-
-                    # Save attachment to disk
-                    attachment_path = output_dir / attachment_filename
-                    with open(attachment_path, "wb") as f:
-                        decoded_attachment = part.get_payload(decode=True)
-                        if decoded_attachment:
-                            f.write(decoded_attachment)
-                        else:
-                            logger.debug(f"Attachment Missing: {filename}")
-
-                    logger.debug(f"Saved attachment: {attachment_filename}")
-
-                    attachments.append(
-                        {
-                            "filename": filename,
-                            "saved_filename": attachment_filename,
-                            "content_type": part.get_content_type(),
-                        }
-                    )
-        self._attachments = attachments
-        return attachments
+        Each is moved into place whole, so an existing file is always
+        complete even with several processes saving the same attachment.
+
+        Args:
+            output_dir: The directory where attachments should be saved
+            staging_dir: The directory they are written to first
+        """
+        self.stage_attachments(output_dir, staging_dir)
+        for name, staged in self.staged.items():
+            os.replace(staged, output_dir / name)
+            logger.debug(f"Saved attachment: {name}")
+        self.staged = {}
+        return self.attachments
+
+    def discard_attachments(self):
+        """Delete the attachments staged for an email that is not being kept."""
+        for staged in self.staged.values():
+            Path(staged).unlink(missing_ok=True)
+        self.staged = {}
 
     @property
     def filename(self):
-        return f"{self.idx}.json"
+        """The email file's path relative to the emails directory."""
+        return email_filename(self.idx)
 
     def to_json(self):
         """Return the JSON representation of the email."""
-        return json.dumps(self.to_dict, ensure_ascii=False, indent=None)
+        return json_dumps(self.to_dict).decode("utf-8")
 
     def save(self, output_dir: Path):
         """
-        Save the email to a file named self.idx.json in the given directory.
+        Save the email to its file (see filename) under the given directory.
+
+        The headers go out in one piece; the bodies and attachments, which
+        come last, are written a field at a time, so no more than one body is
+        held encoded at once rather than a second copy of the whole email.
 
         Args:
             output_dir: The directory where the email should be saved
         """
-        with (output_dir / self.filename).open(mode="w", encoding="utf-8") as f:
-            f.write(self.to_json())
+        data = self.to_dict
+        head = {name: value for name, value in data.items() if name not in LARGE_FIELDS}
+        with (output_dir / self.filename).open(mode="wb") as f:
+            # Without its closing brace, so the large fields can follow
+            f.write(json_dumps(head)[:-1])
+            for name in LARGE_FIELDS:
+                f.write(b",")
+                f.write(json_dumps(name))
+                f.write(b":")
+                f.write(json_dumps(data[name]))
+            f.write(b"}")
+
+    def search_fields(self):
+        """
+        Return the pieces of text the search index is built from.
+
+        The HTML body is left out when there is a text body, which in
+        practice holds the same words without the markup. An HTML-only email
+        is indexed as the text it shows, so tag names, class names, styles and
+        entities do not crowd the index.
+        """
+        body = self.body_text or html_text(self.body_html)
+        return (self.subject, *self.addresses, body)
 
-    def search_content(self):
-        return f"{self.subject} {' '.join(self.addresses)} {self.body_text} {self.body_html}"
+    @cached_property
+    def search_words(self):
+        """
+        Return the set of words the search index records for this email.
+
+        Worked out by prepare(), so tokenizing runs in the worker processes
+        rather than in the one process that builds the index. Each field is
+        tokenized on its own rather than joined into one more copy of the
+        body first.
+        """
+        # Imported here: search imports this module
+        from .search import tokenize
+        words = set()
+        for field in self.search_fields():
+            words.update(tokenize(field))
+        return words
 
     def search_entry(self):
         """Return the data needed for adding to the search indexes."""
@@ -338,8 +629,8 @@ class Hail:
         # Save the ID to email mapping
         id_mapping_file = dir / "id_mapping.json"
         tmp_file = id_mapping_file.with_name(id_mapping_file.name + ".tmp")
-        with open(tmp_file, 'w', encoding='utf-8') as f:
-            json.dump(cls.d, f, ensure_ascii=False, indent=None)
+        with open(tmp_file, 'wb') as f:
+            f.write(json_dumps(cls.d))
         os.replace(tmp_file, id_mapping_file)
 
     @classmethod
@@ -352,36 +643,33 @@ class Hail:
         the index that follows them).
         """
         id_mapping_file = dir / "id_mapping.json"
-        with open(id_mapping_file, "r", encoding="utf-8") as f:
-            mapping = json.load(f)
+        mapping = json_load(id_mapping_file)
 
         if not isinstance(mapping, dict):
             raise ValueError(f"{id_mapping_file} is not a JSON object")
 
-        cls.d = {}
-        cls.ls = []
+        # Only the indexes, to catch one used twice; indexes left unused by
+        # forget() are simply absent
+        used = set()
         for original_id, idx in mapping.items():
             if not isinstance(idx, int) or idx < 0:
                 raise ValueError(f"{id_mapping_file} has a bad index for {original_id}: {idx!r}")
-            if idx >= len(cls.ls):
-                # Grow the list; unused slots stay None (see forget()).
-                cls.ls.extend([None] * (idx + 1 - len(cls.ls)))
-            if cls.ls[idx] is not None:
+            if idx in used:
+                owner = next(other for other, i in mapping.items() if i == idx)
                 raise ValueError(
-                    f"{id_mapping_file} maps both {cls.ls[idx]} and {original_id} to index {idx}"
+                    f"{id_mapping_file} maps both {owner} and {original_id} to index {idx}"
                 )
-            cls.ls[idx] = original_id
-            cls.d[original_id] = idx
+            used.add(idx)
 
-        return len(cls.ls)
+        cls.d = mapping
+        cls.next_idx = max(used, default=-1) + 1
+        return cls.next_idx
 
     @classmethod
     def forget(cls, original_id):
         """
         Drop an id from the mapping so a message that failed part way through
-        processing is retried on the next run. The slot in `ls` is left empty
-        rather than reused, so indexes already handed out stay valid.
+        processing is retried on the next run. Its index is not handed out
+        again, so indexes already handed out stay valid.
         """
-        idx = cls.d.pop(original_id, None)
-        if idx is not None:
-            cls.ls[idx] = None
\ No newline at end of file
+        cls.d.pop(original_id, None)
\ No newline at end of file
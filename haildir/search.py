@@ -1,13 +1,32 @@
-import json
 import os
-import re
+import base64
 import collections
+from array import array
+import heapq
+import contextlib
+import itertools
+import struct
+import tempfile
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import IO, Dict, Iterator, List, Set
 from . import hail
 
 RESULT_LIMIT = 500
 
+# Memory, in MiB, the posting lists may take before they are written out to
+# a temporary file (see InvertedIndex)
+INDEX_MEMORY = 128
+
+# Rough cost of one word in memory beyond its ids: the key, the dict slot and
+# the array object. An estimate, used only to decide when to spill.
+WORD_OVERHEAD = 200
+
+# Maps every byte but ASCII lowercase letters and digits to a space. Words are
+# the runs that are left, as the client's /[a-z0-9]+/ finds them after it
+# lowercases; a non-ASCII character (a '?' after encoding) splits a word there.
+TOKEN_TABLE = bytes(b if b in b"abcdefghijklmnopqrstuvwxyz0123456789" else 32 for b in range(256))
+
 def tokenize(text: str) -> List[str]:
     """
     Tokenize text into words, converting to lowercase and removing punctuation.
@@ -16,19 +35,106 @@ def tokenize(text: str) -> List[str]:
     index.js). The two have to agree: a term the client does not split the way
     this does can never match a key in the index.
     """
-    # Convert to lowercase and split on whitespace and punctuation
-    words = re.findall(r'\b[a-zA-Z0-9]+\b', text.lower())
-    return words
+    # Convert to lowercase and split on everything else, each step one pass in C
+    ascii_text = text.lower().encode("ascii", "replace").translate(TOKEN_TABLE)
+    return ascii_text.decode("ascii").split()
+
+# The array type code for posting lists: unsigned int, at least 32 bits
+POSTING_TYPE = "I"
+POSTING_SIZE = array(POSTING_TYPE).itemsize
+
+# A binary copy of search_index.json that an incremental build loads instead,
+# sparing it the JSON parse and the unpacking of every posting list. It opens
+# with the size and mtime of the search_index.json it was written with (and
+# the posting size of the machine that wrote it), and is ignored unless they
+# still match. Then comes a record per word: its length in bytes and its
+# number of ids, the word in UTF-8, and the ids as the raw bytes of their
+# array. A dropped word has no ids.
+INDEX_CACHE_FILE = "search_index.bin"
+CACHE_HEADER = struct.Struct("<QqB")
+CACHE_RECORD = struct.Struct("<II")
+
+def posting_list() -> array:
+    return array(POSTING_TYPE)
+
+def encode_postings(email_ids) -> str:
+    """
+    Pack a sorted posting list into the string search_index.json stores.
+
+    Each id is written as its difference from the one before, as a varint
+    (seven bits a byte, low bits first, the high bit set on every byte but
+    the last), and the bytes are base64-encoded. The gaps between the ids
+    of a common word are small, so most take a single byte where the JSON
+    list spent a digit apiece plus a comma. `decodePostings` in index.js
+    reads it back.
+    """
+    packed = bytearray()
+    previous = 0
+    for email_id in email_ids:
+        gap = email_id - previous
+        previous = email_id
+        while gap >= 0x80:
+            packed.append(gap & 0x7F | 0x80)
+            gap >>= 7
+        packed.append(gap)
+    return base64.b64encode(packed).decode("ascii")
+
+def decode_postings(encoded: str) -> array:
+    """Unpack a posting list written by encode_postings."""
+    email_ids = posting_list()
+    email_id = 0
+    gap = 0
+    shift = 0
+    for byte in base64.b64decode(encoded):
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            email_id += gap
+            email_ids.append(email_id)
+            gap = 0
+            shift = 0
+    return email_ids
+
+def write_cache_record(cache: IO[bytes], word: str, email_ids) -> None:
+    """Write one word's record to the cache file (see INDEX_CACHE_FILE)."""
+    packed_word = word.encode("utf-8")
+    email_ids = array(POSTING_TYPE, email_ids)
+    cache.write(CACHE_RECORD.pack(len(packed_word), len(email_ids)))
+    cache.write(packed_word)
+    cache.write(email_ids.tobytes())
 
 class InvertedIndex:
-    """An inverted index that can be built incrementally."""
+    """
+    An inverted index that can be built incrementally.
+
+    Posting lists are collected in memory until they take an estimated
+    memory_limit bytes, then written out sorted by word as a run in a
+    temporary file. save() merges the runs with what is still in memory and
+    streams the result to search_index.json, so the whole index is never held
+    at once however large the archive.
+    """
 
     def __init__(self, output_path: Path, load_existing: bool = False,
-                 result_limit: int = RESULT_LIMIT):
+                 result_limit: int = RESULT_LIMIT,
+                 memory_limit: int = INDEX_MEMORY << 20,
+                 cache_file: Path | None = None):
         self.output_path = output_path
         self.index_file = output_path / "search_index.json"
+        # Where to keep the binary copy (see INDEX_CACHE_FILE), if anywhere
+        self.cache_file = cache_file
         self.result_limit = result_limit
-        self.inverted_index: Dict[str, Set[int]] = collections.defaultdict(set)
+        self.memory_limit = memory_limit
+        # Each email is added at most once, with a higher index than any before
+        # it, so appending keeps a posting list sorted and free of repeats.
+        # Unsigned 32-bit arrays: 4 bytes an id rather than a list's 8-byte
+        # pointer to an int object.
+        self.inverted_index: Dict[str, array] = collections.defaultdict(posting_list)
+        self.postings = 0
+        # Runs already written out, oldest first, and how many ids each word
+        # has in them, so the posting limit still counts every email
+        self.runs: List[IO[str]] = []
+        self.spilled: Dict[str, int] = {}
         # Words that matched too many emails to be worth indexing. They are
         # stored in the index file as empty posting lists, which the client
         # treats exactly like a word that is not in the index at all.
@@ -39,17 +145,66 @@ class InvertedIndex:
     def load(self) -> None:
         """Load an index written by a previous run so it can be extended."""
         self.pending_load = False
-        with open(self.index_file, 'r', encoding='utf-8') as f:
-            existing = json.load(f)
+        if self.load_cache():
+            return
+        existing = hail.json_load(self.index_file)
 
         if not isinstance(existing, dict):
             raise ValueError(f"{self.index_file} is not a JSON object")
 
         for word, email_ids in existing.items():
             if email_ids:
-                self.inverted_index[word] = set(email_ids)
+                # Builds from before the lists were packed wrote plain arrays
+                if isinstance(email_ids, str):
+                    email_ids = decode_postings(email_ids)
+                else:
+                    email_ids = array(POSTING_TYPE, email_ids)
+                self.inverted_index[word] = email_ids
+                self.postings += len(email_ids)
             else:
                 self.dropped.add(word)
+        del existing
+        if self.spill_due():
+            self.spill()
+
+    def load_cache(self) -> bool:
+        """
+        Load the index from the cache file, if there is one that matches
+        search_index.json. Returns whether it did.
+        """
+        if self.cache_file is None:
+            return False
+        try:
+            with open(self.cache_file, "rb") as f:
+                index_stat = os.stat(self.index_file)
+                header = CACHE_HEADER.unpack(f.read(CACHE_HEADER.size))
+                if header != (index_stat.st_size, index_stat.st_mtime_ns, POSTING_SIZE):
+                    return False
+                inverted_index = {}
+                dropped = set()
+                while record := f.read(CACHE_RECORD.size):
+                    word_size, count = CACHE_RECORD.unpack(record)
+                    word = f.read(word_size)
+                    if len(word) != word_size:
+                        raise ValueError("truncated")
+                    word = word.decode("utf-8")
+                    if count:
+                        email_ids = posting_list()
+                        email_ids.fromfile(f, count)
+                        inverted_index[word] = email_ids
+                    else:
+                        dropped.add(word)
+        except (OSError, EOFError, struct.error, ValueError):
+            # Missing, stale or damaged: search_index.json has it all anyway
+            return False
+
+        self.inverted_index.update(inverted_index)
+        self.postings += sum(map(len, inverted_index.values()))
+        self.dropped |= dropped
+        del inverted_index
+        if self.spill_due():
+            self.spill()
+        return True
 
     def add_email(self, msg: hail.Hail) -> None:
         """Add an email to the inverted index."""
@@ -57,15 +212,84 @@ class InvertedIndex:
         if self.pending_load:
             self.load()
 
-        # Tokenize the content
-        words = tokenize(msg.search_content())
+        # A posting list records which emails hold a word, not how often, so
+        # the words come as a set rather than visited once per occurrence.
+        # Never revive a dropped word: its posting list is incomplete, so a
+        # partial list of hits would be worse than no hits at all. Taking
+        # them out with one set difference keeps that check out of the loop.
+        words = msg.search_words - self.dropped
 
         # Add each word to the index
+        inverted_index = self.inverted_index
+        spilled = self.spilled
+        idx = msg.idx
+        result_limit = self.result_limit
+        self.postings += len(words)
         for word in words:
-            # Never revive a dropped word: its posting list is incomplete, so a
-            # partial list of hits would be worse than no hits at all.
-            if word not in self.dropped:
-                self.inverted_index[word].add(msg.idx)
+            email_ids = inverted_index[word]
+            email_ids.append(idx)
+            if len(email_ids) + spilled.get(word, 0) >= result_limit:
+                # Lists only grow, so this word would be dropped at save()
+                # anyway; drop it now and stop holding its list. Whatever
+                # of it was spilled is skipped when the runs are merged.
+                self.postings -= len(email_ids)
+                del inverted_index[word]
+                spilled.pop(word, None)
+                self.dropped.add(word)
+
+        if self.spill_due():
+            self.spill()
+
+    def memory_used(self) -> int:
+        """
+        Estimate the memory the index takes, in bytes: the posting lists held
+        in memory, and the words spilled or dropped, which are remembered
+        for as long as the build runs.
+        """
+        words = len(self.inverted_index) + len(self.spilled) + len(self.dropped)
+        return self.postings * POSTING_SIZE + words * WORD_OVERHEAD
+
+    def spill_due(self) -> bool:
+        """
+        Whether the posting lists in memory should be written out.
+
+        Only the lists can be: the spilled and dropped words stay however
+        often it spills. So once those alone take half the limit, the lists
+        still get half of it rather than being spilled after every email.
+        """
+        remembered = (len(self.spilled) + len(self.dropped)) * WORD_OVERHEAD
+        return self.memory_used() >= max(self.memory_limit, remembered + self.memory_limit // 2)
+
+    def spill(self) -> None:
+        """Write the posting lists held in memory out as a run, and clear them."""
+        run = tempfile.TemporaryFile("w+", encoding="ascii")
+        for word in sorted(self.inverted_index):
+            email_ids = self.inverted_index[word]
+            run.write(f"{word} {' '.join(map(str, email_ids))}\n")
+            self.spilled[word] = self.spilled.get(word, 0) + len(email_ids)
+        run.seek(0)
+        self.runs.append(run)
+        self.inverted_index = collections.defaultdict(posting_list)
+        self.postings = 0
+
+    def merged(self) -> Iterator[tuple[str, List[int]]]:
+        """Yield each word with its whole posting list, in word order."""
+        def read_run(run):
+            for line in run:
+                word, _, email_ids = line.partition(" ")
+                yield word, email_ids
+
+        in_memory = ((word, self.inverted_index[word]) for word in sorted(self.inverted_index))
+        # merge() keeps equal words in the order of its inputs, oldest run
+        # first, which is the order of their email ids
+        parts = heapq.merge(*map(read_run, self.runs), in_memory, key=itemgetter(0))
+        for word, group in itertools.groupby(parts, key=itemgetter(0)):
+            if word in self.dropped:
+                continue
+            email_ids = []
+            for _, part in group:
+                email_ids.extend(map(int, part.split()) if isinstance(part, str) else part)
+            yield word, email_ids
 
     def save(self) -> None:
         """Finalize the index files by writing them to disk."""
@@ -73,21 +297,62 @@ class InvertedIndex:
             # Nothing was added, but saving must not drop what is already there
             self.load()
 
-        # Convert sets to lists for JSON serialization
-        serializable_index = {}
-        for word, email_ids in self.inverted_index.items():
-            if len(email_ids) < self.result_limit:
-                serializable_index[word] = sorted(email_ids)
-            else:
-                self.dropped.add(word)
-
-        # Record the dropped words so a later incremental build keeps ignoring them
-        for word in self.dropped:
-            serializable_index[word] = []
-
         # Save the inverted index by replacing it, so an interrupted write
-        # leaves the previous index intact
+        # leaves the previous index intact. Every list is under the limit:
+        # add_email drops a word the moment its list reaches it.
         tmp_file = self.index_file.with_name(self.index_file.name + ".tmp")
-        with open(tmp_file, 'w', encoding='utf-8') as f:
-            json.dump(serializable_index, f, ensure_ascii=False, indent=None)
-        os.replace(tmp_file, self.index_file)
\ No newline at end of file
+        with contextlib.ExitStack() as stack:
+            f = stack.enter_context(open(tmp_file, 'wb', buffering=hail.WRITE_BUFFER_SIZE))
+            cache = None
+            if self.cache_file is not None:
+                self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_cache = self.cache_file.with_name(self.cache_file.name + ".tmp")
+                cache = stack.enter_context(
+                    open(tmp_cache, 'wb', buffering=hail.WRITE_BUFFER_SIZE)
+                )
+                # Filled in once search_index.json is complete
+                cache.write(bytes(CACHE_HEADER.size))
+
+            separator = b"{"
+            for word, email_ids in self.merged():
+                f.write(separator)
+                f.write(hail.json_dumps(word))
+                f.write(b':"')
+                f.write(encode_postings(email_ids).encode("ascii"))
+                f.write(b'"')
+                separator = b","
+                if cache is not None:
+                    write_cache_record(cache, word, email_ids)
+
+            # Record the dropped words so a later incremental build keeps ignoring them
+            for word in sorted(self.dropped):
+                f.write(separator)
+                f.write(hail.json_dumps(word))
+                f.write(b':""')
+                separator = b","
+                if cache is not None:
+                    write_cache_record(cache, word, ())
+
+            if separator == b"{":
+                # An empty index
+                f.write(separator)
+            f.write(b"}")
+
+            if cache is not None:
+                # Renaming keeps the mtime, so this is what the next run will see
+                f.flush()
+                index_stat = os.stat(tmp_file)
+                cache.seek(0)
+                cache.write(CACHE_HEADER.pack(index_stat.st_size, index_stat.st_mtime_ns, POSTING_SIZE))
+        os.replace(tmp_file, self.index_file)
+        if cache is not None:
+            # Replaced second: a cache left over from the previous index no
+            # longer matches it and is ignored
+            os.replace(tmp_cache, self.cache_file)
+        self.close()
+
+    def close(self) -> None:
+        """Delete the spilled runs."""
+        for run in self.runs:
+            run.close()
+        self.runs = []
@@ -28,6 +28,17 @@ def write(root: Path, n: int, frm: str, subject: str, body: str) -> None:
     )
 
 
+def write_undated(root: Path, name: str, subject: str, body: str) -> None:
+    (root / "cur" / name).write_text(
+        f"From: d@example.com\n"
+        f"To: clint@example.com\n"
+        f"Subject: {subject}\n"
+        f"Message-ID: <{name}@example.com>\n"
+        f"\n{body}\n",
+        encoding="utf-8",
+    )
+
+
 def generate(root: Path) -> None:
     shutil.rmtree(root, ignore_errors=True)
     for name in ("cur", "new", "tmp"):
@@ -50,7 +61,12 @@ def generate(root: Path) -> None:
     write(root, 1005, "Deep Thought <deep.thought@hitchhiker.example>", "Answer",
           "Contact deep.thought@hitchhiker.example about the answer, 42.")
 
-    print(f"Wrote {COMMON + 6} messages to {root}")
+    # No Date header: the date falls back to the delivery time in a Maildir
+    # unique name, but not to digits in a name that merely starts with some
+    write_undated(root, "1700000000.M1P2.host", "Delivered", "dated by its file name")
+    write_undated(root, "20231015123456.host", "Undated", "dated by nothing")
+
+    print(f"Wrote {COMMON + 8} messages to {root}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+"""
+Check html_text, which indexes HTML-only emails, on bodies built to be slow.
+
+Run with:  rake html_text_test
+
+Each opener of a hidden block (a comment, a style sheet, a script) with no
+closer used to send the pattern to the end of the body and back, once per
+opener. A spam message full of them stalled a worker for seconds, so these
+bodies are large and each call has to come back well within LIMIT. A stray
+'<' in text did the same to the tag pattern.
+"""
+
+import sys
+import time
+
+from haildir.hail import html_text
+
+# Seconds one call may take; the bodies below take milliseconds
+LIMIT = 1.0
+
+failures = 0
+
+
+def check(name, body, shown, hidden):
+    global failures
+    start = time.perf_counter()
+    text = html_text(body)
+    elapsed = time.perf_counter() - start
+    problems = []
+    if elapsed > LIMIT:
+        problems.append(f"took {elapsed:.2f}s")
+    problems += [f"lost {word!r}" for word in shown if word not in text]
+    problems += [f"kept {word!r}" for word in hidden if word in text]
+    if problems:
+        failures += 1
+        print(f"FAIL {name}: {', '.join(problems)}")
+    else:
+        print(f"ok   {name}")
+
+
+check("unclosed comments hide the rest of the body",
+      "<p>shown</p>" + "<!--hidden " * 20000, ["shown"], ["hidden"])
+check("unclosed style sheets hide the rest of the body",
+      "<p>shown</p>" + "<style hidden " * 20000, ["shown"], ["hidden"])
+check("unclosed scripts hide the rest of the body",
+      "<p>shown</p>" + "<SCRIPT>hidden " * 20000, ["shown"], ["hidden"])
+check("a stray '<' is not taken for a tag",
+      "a < b " * 20000 + "<b>bold</b>", ["bold", "a < b"], ["<b>"])
+check("closed blocks hide only themselves",
+      "<style>p {}</style>before<!-- note -->after<script>x()</script>end",
+      ["before", "after", "end"], ["note", "x()"])
+
+print(f"\n{failures} failed" if failures else "\nAll html_text checks passed.")
+sys.exit(1 if failures else 0)
@@ -0,0 +1,116 @@
+"""
+Check the search index's two less travelled paths: the posting lists spilled
+to sorted runs and merged on save, and the binary copy an incremental build
+loads in place of search_index.json.
+
+Run with:  rake index_test
+
+The emails are stand-ins carrying only what InvertedIndex reads from a Hail,
+with words drawn at random (from a fixed seed) so some grow common enough to
+be dropped.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from haildir.search import INDEX_CACHE_FILE, InvertedIndex
+
+EMAILS = 3000
+VOCABULARY = [f"w{n}" for n in range(400)]
+RESULT_LIMIT = 300
+
+# Small enough that the spilled build writes its lists out many times over
+SPILL_MEMORY = 64 << 10
+
+failures = 0
+
+
+def check(name, got, want):
+    global failures
+    if got != want:
+        failures += 1
+        print(f"FAIL {name}\n       got  {got!r:.200}\n       want {want!r:.200}")
+    else:
+        print(f"ok   {name}")
+
+
+def emails(start, stop):
+    for idx in range(start, stop):
+        rng = random.Random(idx)
+        # Skewed, so the first words turn up in most emails and the last rarely
+        words = {rng.choice(VOCABULARY[:rng.randint(1, len(VOCABULARY))]) for _ in range(12)}
+        yield SimpleNamespace(idx=idx, search_words=words)
+
+
+def build(output_path, start, stop, load_existing=False, memory_limit=64 << 20):
+    index = InvertedIndex(
+        output_path, load_existing=load_existing, result_limit=RESULT_LIMIT,
+        memory_limit=memory_limit, cache_file=output_path / INDEX_CACHE_FILE,
+    )
+    for email in emails(start, stop):
+        index.add_email(email)
+    spilled = len(index.runs)
+    index.save()
+    return spilled
+
+
+def read(path):
+    return path.read_bytes()
+
+
+root = Path(tempfile.mkdtemp(prefix="index_test."))
+try:
+    in_memory, spilled, incremental, stale = (root / name for name in
+                                              ("memory", "spilled", "incremental", "stale"))
+    for path in (in_memory, spilled, incremental, stale):
+        path.mkdir()
+
+    # Spilling changes where the lists wait, never what is written
+    build(in_memory, 0, EMAILS)
+    runs = build(spilled, 0, EMAILS, memory_limit=SPILL_MEMORY)
+    check("the small budget spills", runs > 1, True)
+    check("a spilled index is written the same as one built in memory",
+          read(spilled / "search_index.json"), read(in_memory / "search_index.json"))
+
+    # An incremental build from the binary copy matches building it all at once
+    build(incremental, 0, EMAILS // 2)
+    probe = InvertedIndex(incremental, load_existing=True,
+                          cache_file=incremental / INDEX_CACHE_FILE)
+    check("the binary copy is used when it matches", probe.load_cache(), True)
+    build(incremental, EMAILS // 2, EMAILS, load_existing=True)
+    check("an incremental build is written the same as a full one",
+          read(incremental / "search_index.json"), read(in_memory / "search_index.json"))
+
+    # A copy that no longer matches search_index.json is ignored, and the
+    # JSON is read instead
+    build(stale, 0, EMAILS // 2)
+    cache = read(stale / INDEX_CACHE_FILE)
+    index_file = stale / "search_index.json"
+    index_file.write_bytes(read(index_file) + b" ")
+    probe = InvertedIndex(stale, load_existing=True, cache_file=stale / INDEX_CACHE_FILE)
+    check("the binary copy is ignored once the index changes size", probe.load_cache(), False)
+
+    build(stale, 0, EMAILS // 2)
+    stat = index_file.stat()
+    os.utime(index_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    probe = InvertedIndex(stale, load_existing=True, cache_file=stale / INDEX_CACHE_FILE)
+    check("the binary copy is ignored once the index is rewritten", probe.load_cache(), False)
+
+    (stale / INDEX_CACHE_FILE).write_bytes(cache[:len(cache) // 2])
+    os.utime(index_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    probe = InvertedIndex(stale, load_existing=True, cache_file=stale / INDEX_CACHE_FILE)
+    check("a truncated binary copy is ignored", probe.load_cache(), False)
+
+    build(stale, EMAILS // 2, EMAILS, load_existing=True)
+    check("an index read from the JSON is extended the same way",
+          read(index_file), read(in_memory / "search_index.json"))
+finally:
+    shutil.rmtree(root)
+
+print(f"\n{failures} failed" if failures else "\nAll index checks passed.")
+sys.exit(1 if failures else 0)
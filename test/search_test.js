@@ -8,13 +8,14 @@
 const fs = require('fs');
 const path = require('path');
 
-const { tokenize, searchIds, searchNotes } = require(
+const { tokenize, decodePostings, searchIds, searchNotes, addressesStartingWith } = require(
     path.join(__dirname, '..', 'haildir', 'assets', 'index.js'));
 
 const out = process.argv[2];
 const searchIndex = JSON.parse(fs.readFileSync(path.join(out, 'search_index.json')));
 const idMapping = JSON.parse(fs.readFileSync(path.join(out, 'id_mapping.json')));
 const indexData = JSON.parse(fs.readFileSync(path.join(out, 'index.json')));
+const addresses = JSON.parse(fs.readFileSync(path.join(out, 'addresses.json')));
 
 function search(term) {
     const result = searchIds(term, searchIndex);
@@ -73,5 +74,27 @@ check('a word too common to index does not cancel a real one',
 check('an empty query constrains nothing', search('').count, total);
 check('a query of only punctuation constrains nothing', search('---').count, total);
 
+// A message without a Date header is dated by the delivery time its Maildir
+// file name records, and left undated when the name only looks like one.
+const dateOf = subject => indexData.find(email => email.subject === subject).date;
+check('a message with no Date is dated by its Maildir name', dateOf('Delivered'), '2023-11-14 22:13');
+check('a file name that is not a Maildir name gives no date', dateOf('Undated'), '');
+
+// Posting lists are packed by encode_postings in search.py. This one was packed
+// there, and covers gaps of one and several bytes up to the largest 32-bit id.
+check('a packed posting list unpacks to its ids',
+      decodePostings('AAF+AawBxKAEj937/w8='), [0, 1, 127, 128, 300, 70000, 4294967295]);
+check('a dropped word unpacks to an empty list', decodePostings(''), []);
+
+// The autocomplete binary-searches addresses.json, so it relies on the list
+// being sorted the way JavaScript compares strings.
+check('addresses.json is sorted',
+      addresses.every((address, i) => i === 0 || addresses[i - 1] < address), true);
+for (const prefix of ['a', addresses[0].slice(0, 3), addresses[addresses.length - 1], 'zzzz']) {
+    check(`the addresses starting with "${prefix}" are all found`,
+          addressesStartingWith(addresses, prefix, addresses.length),
+          addresses.filter(address => address.startsWith(prefix)));
+}
+
 console.log(failures ? `\n${failures} failed` : '\nAll search checks passed.');
 process.exit(failures ? 1 : 0);